@@ -11,6 +11,8 @@ from datetime import datetime, timezone
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort
 from flask_login import current_user, login_required
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, raiseload
 
 from models import db, User, Referral
 
@@ -61,8 +63,10 @@ def dashboard():
     approved_users = User.query.filter_by(approved=True).count()
 
     # Recent pending users for quick approve
-    pending_list = User.query.filter_by(approved=False)\
-        .order_by(User.created_at.desc()).limit(5).all()
+    pending_list = db.session.execute(
+        select(User).options(raiseload('*')).filter_by(approved=False)
+        .order_by(User.created_at.desc()).limit(5)
+    ).scalars().all()
 
     # Pipeline status
     pipeline_status = _read_pipeline_status()
@@ -85,7 +89,10 @@ def dashboard():
 @admin_required
 def users():
     """User management — list all users with approve/revoke controls."""
-    all_users = User.query.order_by(User.created_at.desc()).all()
+    # raiseload: the list view must not trigger per-row relationship loads
+    all_users = db.session.execute(
+        select(User).options(joinedload(User.terms), raiseload('*')).order_by(User.created_at.desc())
+    ).scalars().all()
     return render_template('admin/users.html', users=all_users)
 
 
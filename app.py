@@ -9,11 +9,13 @@ from pathlib import Path
 from datetime import datetime, timezone
 from functools import wraps
 
-from flask import Flask, render_template, redirect, url_for, request, flash, send_from_directory, abort
+from flask import Flask, Blueprint, render_template, redirect, url_for, request, flash, send_from_directory, abort
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 import bcrypt
+from sqlalchemy import select, update
+from sqlalchemy.orm import configure_mappers
 
-from models import db, User, CapitalRecord, Referral, generate_referral_code
+from models import db, User, CapitalRecord, Referral, TermsVersion, add_with_referral_code
 from admin import admin_bp
 
 # --- Config ---
@@ -36,25 +38,48 @@ def _load_json(path):
     except Exception:
         return {}
 
-app = Flask(__name__, static_folder='static', template_folder='templates')
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-change-this-in-production')
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{BASE_DIR / "efpwealth.db"}'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+main = Blueprint('main', __name__, cli_group=None)
 
-db.init_app(app)
-app.register_blueprint(admin_bp)
-
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
 login_manager.login_message = 'Please log in to access this page.'
 
 
+def create_app(secret_key=None):
+    """Build the Flask app: config, extensions, blueprints and tables.
+
+    secret_key overrides the SECRET_KEY environment variable (wsgi.py passes it in).
+    """
+    app = Flask(__name__, static_folder='static', template_folder='templates')
+    app.config['SECRET_KEY'] = secret_key or os.environ.get('SECRET_KEY', 'dev-change-this-in-production')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{BASE_DIR / "efpwealth.db"}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'query_cache_size': 1200,   # compiled-SQL cache shared by repeated ORM queries
+        'pool_size': 5,             # persistent connections reused across requests
+        'max_overflow': 10,
+        'pool_recycle': 280,        # recycle before server-side idle timeouts (e.g. MySQL on PythonAnywhere)
+        'pool_pre_ping': True,
+    }
+
+    db.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(main)
+    app.register_blueprint(admin_bp)
+
+    with app.app_context():
+        db.create_all()
+    # Resolve mapper relationships now, at worker boot, instead of on the first request
+    configure_mappers()
+    return app
+
+
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
 
 
-@app.context_processor
+@main.app_context_processor
 def inject_globals():
     """Make current date/year, site metrics, content, and SEBI status available in all templates."""
     now = datetime.now(timezone.utc)
@@ -68,7 +93,7 @@ def inject_globals():
     )
 
 
-@app.template_filter('fill_metrics')
+@main.app_template_filter('fill_metrics')
 def fill_metrics(text, metrics_dict):
     """Replace {key} placeholders in content strings with metric values."""
     if not text or not metrics_dict:
@@ -78,6 +103,13 @@ def fill_metrics(text, metrics_dict):
     return text
 
 
+def _is_plausible_email(email):
+    """Basic shape check: fits the String(254) email columns, one '@', dotted domain, no separators."""
+    local, _, domain = email.partition('@')
+    return (len(email) <= 254 and bool(local) and '.' in domain.strip('.')
+            and '@' not in domain and not any(c.isspace() or c in ';<>' for c in email))
+
+
 # --- Decorators ---
 
 def terms_required(f):
@@ -85,21 +117,21 @@ def terms_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         if not current_user.terms_accepted_at:
-            return redirect(url_for('accept_terms'))
+            return redirect(url_for('main.accept_terms'))
         return f(*args, **kwargs)
     return decorated
 
 
 # --- Public Routes ---
 
-@app.route('/')
+@main.route('/')
 def landing():
     site_data = _load_json(_metrics_path)
     return render_template('landing.html',
         equity_curve_json=json.dumps(site_data.get('equity_curve', {})))
 
 
-@app.route('/performance')
+@main.route('/performance')
 def performance():
     site_data = _load_json(_metrics_path)
     return render_template('performance.html',
@@ -107,22 +139,22 @@ def performance():
         drawdown_json=json.dumps(site_data.get('drawdown', {})))
 
 
-@app.route('/approach')
+@main.route('/approach')
 def approach():
     site_data = _load_json(_metrics_path)
     return render_template('approach.html',
         allocation_json=json.dumps(site_data.get('allocation', {})))
 
 
-@app.route('/about')
+@main.route('/about')
 def about():
     return render_template('about.html')
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@main.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
 
     if request.method == 'POST':
         email = request.form.get('email', '').strip().lower()
@@ -132,20 +164,20 @@ def login():
         if user and bcrypt.checkpw(password.encode(), user.password_hash.encode()):
             if not user.approved:
                 flash('Your account is pending approval. We will notify you once approved.', 'warning')
-                return redirect(url_for('login'))
+                return redirect(url_for('main.login'))
             login_user(user, remember=True)
             next_page = request.args.get('next')
-            return redirect(next_page or url_for('dashboard'))
+            return redirect(next_page or url_for('main.dashboard'))
         else:
             flash('Invalid email or password.', 'error')
 
     return render_template('login.html')
 
 
-@app.route('/register', methods=['GET', 'POST'])
+@main.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
 
     if request.method == 'POST':
         name = request.form.get('name', '').strip()
@@ -154,15 +186,19 @@ def register():
 
         if not name or not email or not password:
             flash('All fields are required.', 'error')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
 
         if len(password) < 8:
             flash('Password must be at least 8 characters.', 'error')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
+
+        if len(email) > 254:
+            flash('Please enter a valid email address.', 'error')
+            return redirect(url_for('main.register'))
 
         if User.query.filter_by(email=email).first():
             flash('An account with this email already exists.', 'error')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
 
         pw_hash = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
 
@@ -180,9 +216,8 @@ def register():
             name=name,
             approved=False,
             referred_by=referred_by_id,
-            referral_code=generate_referral_code(),
         )
-        db.session.add(user)
+        add_with_referral_code(user)
         db.session.commit()
 
         # Update referral tracking
@@ -201,60 +236,58 @@ def register():
             db.session.commit()
 
         flash('Registration successful! Your account is pending approval. We will contact you shortly.', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     return render_template('register.html')
 
 
-@app.route('/logout')
+@main.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('landing'))
+    return redirect(url_for('main.landing'))
 
 
 # --- T&C Gate ---
 
-@app.route('/accept-terms', methods=['GET', 'POST'])
+@main.route('/accept-terms', methods=['GET', 'POST'])
 @login_required
 def accept_terms():
     if current_user.terms_accepted_at:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
 
     if request.method == 'POST':
         current_user.terms_accepted_at = datetime.now(timezone.utc)
-        current_user.terms_version = CURRENT_TERMS_VERSION
+        current_user.terms = TermsVersion.get_or_create(CURRENT_TERMS_VERSION)
         db.session.commit()
         flash('Terms accepted. Welcome to your dashboard.', 'success')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
 
     return render_template('accept_terms.html', terms_version=CURRENT_TERMS_VERSION)
 
 
 # --- Protected Routes ---
 
-@app.route('/dashboard')
+@main.route('/dashboard')
 @login_required
 @terms_required
 def dashboard():
-    # Capital data
-    latest_capital = CapitalRecord.query.filter_by(user_id=current_user.id)\
-        .order_by(CapitalRecord.date.desc()).first()
-
-    capital_history = CapitalRecord.query.filter_by(user_id=current_user.id)\
-        .order_by(CapitalRecord.date.asc()).all()
-
-    # Compute P&L
+    # Capital data (latest snapshot is denormalized onto the user row)
     pnl = 0
     returns_pct = 0
-    if latest_capital and latest_capital.invested > 0:
-        pnl = latest_capital.current_value - latest_capital.invested
-        returns_pct = (latest_capital.current_value / latest_capital.invested - 1) * 100
+    if current_user.latest_invested:
+        pnl = current_user.latest_value - current_user.latest_invested
+        returns_pct = (current_user.latest_value / current_user.latest_invested - 1) * 100
 
     # Chart data
+    capital_history = []
+    if current_user.latest_snapshot_date:
+        capital_history = db.session.query(
+            CapitalRecord.date, CapitalRecord.invested, CapitalRecord.current_value
+        ).filter_by(user_id=current_user.id).order_by(CapitalRecord.date.asc()).all()
     chart_dates = [r.date.isoformat() for r in capital_history]
-    chart_values = [r.current_value for r in capital_history]
-    chart_invested = [r.invested for r in capital_history]
+    chart_values = [float(r.current_value) for r in capital_history]
+    chart_invested = [float(r.invested) for r in capital_history]
 
     # Referral stats
     referral_count = Referral.query.filter_by(referrer_id=current_user.id).count()
@@ -264,7 +297,6 @@ def dashboard():
 
     return render_template('dashboard.html',
         user=current_user,
-        latest_capital=latest_capital,
         pnl=pnl,
         returns_pct=returns_pct,
         chart_dates=json.dumps(chart_dates),
@@ -275,7 +307,7 @@ def dashboard():
     )
 
 
-@app.route('/signals')
+@main.route('/signals')
 @login_required
 @terms_required
 def signals():
@@ -286,61 +318,70 @@ def signals():
     return render_template('signals.html', signals=signals_data, user=current_user)
 
 
-@app.route('/analytics')
+@main.route('/analytics')
 @login_required
 @terms_required
 def analytics():
     return render_template('analytics.html')
 
 
-@app.route('/monthly-report')
+@main.route('/monthly-report')
 @login_required
 @terms_required
 def monthly_report():
     return render_template('monthly_report.html')
 
 
-@app.route('/referrals/invite', methods=['POST'])
+@main.route('/referrals/invite', methods=['POST'])
 @login_required
 @terms_required
 def referral_invite():
-    email = request.form.get('email', '').strip().lower()
-    if not email:
+    # Accepts one address or several separated by commas
+    raw = request.form.get('email', '').strip().lower()
+    emails = list(dict.fromkeys(e.strip() for e in raw.split(',') if e.strip()))
+    if not emails:
         flash('Please enter an email address.', 'error')
-        return redirect(url_for('dashboard'))
-
-    existing = Referral.query.filter_by(
-        referrer_id=current_user.id, referred_email=email
-    ).first()
-    if existing:
+        return redirect(url_for('main.dashboard'))
+
+    rejected = [e for e in emails if not _is_plausible_email(e)]
+    if rejected:
+        flash(f'Not a valid email address: {", ".join(rejected)}', 'error')
+        emails = [e for e in emails if e not in rejected]
+        if not emails:
+            return redirect(url_for('main.dashboard'))
+
+    existing = {email for (email,) in db.session.query(Referral.referred_email).filter(
+        Referral.referrer_id == current_user.id, Referral.referred_email.in_(emails)
+    )}
+    new_emails = [e for e in emails if e not in existing]
+    if not new_emails:
         flash('You have already referred this email.', 'warning')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
 
-    referral = Referral(referrer_id=current_user.id, referred_email=email)
-    db.session.add(referral)
+    Referral.bulk_create(current_user.id, new_emails)
     db.session.commit()
 
-    flash(f'Referral recorded for {email}.', 'success')
-    return redirect(url_for('dashboard'))
+    flash(f'Referral recorded for {", ".join(new_emails)}.', 'success')
+    return redirect(url_for('main.dashboard'))
 
 
 # --- Error Handlers ---
 
-@app.errorhandler(403)
+@main.app_errorhandler(403)
 def forbidden(e):
     return render_template('403.html'), 403
 
 
 # --- CLI Commands ---
 
-@app.cli.command('init-db')
+@main.cli.command('init-db')
 def init_db():
     """Create database tables."""
     db.create_all()
     print('Database initialized.')
 
 
-@app.cli.command('approve-user')
+@main.cli.command('approve-user')
 def approve_user_cmd():
     """Approve a user by email (interactive)."""
     email = input('Email to approve: ').strip().lower()
@@ -360,7 +401,7 @@ def approve_user_cmd():
         print(f'User not found: {email}')
 
 
-@app.cli.command('add-user')
+@main.cli.command('add-user')
 def add_user_cmd():
     """Create and approve a user (interactive)."""
     name = input('Name: ').strip()
@@ -372,34 +413,39 @@ def add_user_cmd():
         password_hash=pw_hash,
         name=name,
         approved=True,
-        referral_code=generate_referral_code(),
     )
-    db.session.add(user)
+    add_with_referral_code(user)
     db.session.commit()
     print(f'Created and approved: {name} ({email}) — referral code: {user.referral_code}')
 
 
-@app.cli.command('list-users')
+@main.cli.command('list-users')
 def list_users_cmd():
     """List all users."""
-    for u in User.query.all():
+    # Plain column rows: no ORM hydration or identity-map bookkeeping per user
+    rows = db.session.execute(select(
+        User.id, User.name, User.email, User.approved, User.terms_accepted_at,
+        TermsVersion.version.label('terms_version'), User.referral_code, User.created_at,
+    ).outerjoin(User.terms).order_by(User.id))
+    for u in rows:
         status = 'approved' if u.approved else 'PENDING'
         terms = f'terms={u.terms_version}' if u.terms_accepted_at else 'no-terms'
         print(f'  {u.id}. {u.name} <{u.email}> [{status}] [{terms}] ref={u.referral_code} {u.created_at}')
 
 
-@app.cli.command('add-capital')
+@main.cli.command('add-capital')
 def add_capital_cmd():
     """Add a capital record for a user."""
     from datetime import date as date_type
+    from decimal import Decimal
     email = input('User email: ').strip().lower()
     user = User.query.filter_by(email=email).first()
     if not user:
         print(f'User not found: {email}')
         return
     date_str = input('Date (YYYY-MM-DD): ').strip()
-    invested = float(input('Total invested (INR): ').strip())
-    current_value = float(input('Current value (INR): ').strip())
+    invested = Decimal(input('Total invested (INR): ').strip())
+    current_value = Decimal(input('Current value (INR): ').strip())
     note = input('Note (optional): ').strip() or None
 
     record = CapitalRecord(
@@ -410,12 +456,13 @@ def add_capital_cmd():
         note=note,
     )
     db.session.add(record)
+    user.apply_capital_record(record)
     db.session.commit()
     pnl = current_value - invested
     print(f'Capital record added for {user.name}: {invested:,.0f} invested, {current_value:,.0f} value, P&L {pnl:+,.0f} on {date_str}')
 
 
-@app.cli.command('add-admin-column')
+@main.cli.command('add-admin-column')
 def add_admin_column():
     """Add is_admin column to users table (one-time migration)."""
     from sqlalchemy import text
@@ -428,7 +475,114 @@ def add_admin_column():
             print(f"Column may already exist: {e}")
 
 
-@app.cli.command('make-admin')
+@main.cli.command('add-capital-summary-columns')
+def add_capital_summary_columns():
+    """Add latest-capital snapshot columns to users table (one-time migration)."""
+    from sqlalchemy import text
+    with db.engine.connect() as conn:
+        for column in ('latest_invested NUMERIC(18, 4)', 'latest_value NUMERIC(18, 4)', 'latest_snapshot_date DATE'):
+            try:
+                conn.execute(text(f"ALTER TABLE users ADD COLUMN {column}"))
+                conn.commit()
+                print(f"Added {column.split()[0]} column to users table.")
+            except Exception as e:
+                print(f"Column may already exist: {e}")
+    print("Run 'flask recompute-capital-summary' to backfill the new columns.")
+
+
+@main.cli.command('recompute-capital-summary')
+def recompute_capital_summary_cmd():
+    """Rebuild every user's latest-capital snapshot from capital records."""
+    # One ordered scan over capital_records, fetched 1000 rows at a time; the last
+    # row seen for each user is their latest snapshot.
+    rows = db.session.execute(
+        select(CapitalRecord.user_id, CapitalRecord.date, CapitalRecord.invested, CapitalRecord.current_value)
+        .order_by(CapitalRecord.user_id, CapitalRecord.date)
+        .execution_options(yield_per=1000)
+    )
+    latest = {}
+    for r in rows:
+        latest[r.user_id] = {
+            'id': r.user_id,
+            'latest_invested': r.invested,
+            'latest_value': r.current_value,
+            'latest_snapshot_date': r.date,
+        }
+    # Clear every snapshot first so users with no records left end up NULL, then
+    # write the rebuilt ones by primary key; both happen in one transaction.
+    db.session.execute(
+        update(User).where(User.latest_snapshot_date.is_not(None)
+                           | User.latest_invested.is_not(None) | User.latest_value.is_not(None))
+        .values(latest_invested=None, latest_value=None, latest_snapshot_date=None)
+    )
+    if latest:
+        db.session.execute(update(User), list(latest.values()))
+    db.session.commit()
+    updated = len(latest)
+    print(f'Capital summary rebuilt for {updated} users.')
+
+
+@main.cli.command('migrate-terms-version')
+def migrate_terms_version():
+    """Move users.terms_version strings to the terms_versions table (one-time migration)."""
+    from sqlalchemy import text
+    with db.engine.connect() as conn:
+        try:
+            conn.execute(text("ALTER TABLE users ADD COLUMN terms_version_id SMALLINT REFERENCES terms_versions (id)"))
+            conn.commit()
+            print("Added terms_version_id column to users table.")
+        except Exception as e:
+            print(f"Column may already exist: {e}")
+    try:
+        # Earliest acceptance stands in for the unknown publish date of legacy versions
+        versions = db.session.execute(text(
+            "SELECT terms_version, MIN(terms_accepted_at) AS first_accepted FROM users "
+            "WHERE terms_version IS NOT NULL GROUP BY terms_version"
+        ).columns(terms_version=db.String, first_accepted=db.DateTime)).all()
+    except Exception as e:
+        print(f"No legacy terms_version column to migrate: {e}")
+        return
+    for version, first_accepted in versions:
+        terms = TermsVersion.query.filter_by(version=version).first()
+        if terms is None:
+            terms = TermsVersion(version=version)
+            if first_accepted:
+                terms.published_at = first_accepted
+            db.session.add(terms)
+        db.session.flush()
+        db.session.execute(text(
+            "UPDATE users SET terms_version_id = :id WHERE terms_version = :version AND terms_version_id IS NULL"
+        ), {'id': terms.id, 'version': version})
+        print(f"Linked users on terms v{version}.")
+    db.session.commit()
+    if not TermsVersion.query.filter_by(version=CURRENT_TERMS_VERSION).first():
+        print(f"Run 'flask publish-terms' to record v{CURRENT_TERMS_VERSION} with its publish date.")
+
+
+@main.cli.command('publish-terms')
+def publish_terms_cmd():
+    """Record a T&C version and its publish date (interactive)."""
+    version = input(f'Terms version [{CURRENT_TERMS_VERSION}]: ').strip() or CURRENT_TERMS_VERSION
+    published_at = datetime.fromisoformat(input('Published on (YYYY-MM-DD): ').strip()).replace(tzinfo=timezone.utc)
+    terms = TermsVersion.query.filter_by(version=version).first()
+    if terms is None:
+        terms = TermsVersion(version=version)
+        db.session.add(terms)
+    terms.published_at = published_at
+    db.session.commit()
+    print(f'Terms v{version} published on {published_at:%d %b %Y}.')
+
+
+@main.cli.command('add-indexes')
+def add_indexes_cmd():
+    """Create indexes missing from existing tables (one-time migration)."""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    print('Indexes are up to date.')
+
+
+@main.cli.command('make-admin')
 def make_admin_cmd():
     """Promote a user to admin by email (interactive)."""
     email = input('Email to make admin: ').strip().lower()
@@ -441,11 +595,5 @@ def make_admin_cmd():
         print(f'User not found: {email}')
 
 
-# --- Init ---
-
-with app.app_context():
-    db.create_all()
-
-
 if __name__ == '__main__':
-    app.run(debug=os.environ.get('FLASK_DEBUG', '0') == '1', port=5000)
+    create_app().run(debug=os.environ.get('FLASK_DEBUG', '0') == '1', port=5000)
@@ -3,39 +3,36 @@ EFP Wealth — Site Data Generator
 Reads equity curves from walk-forward results and outputs site_metrics.json
 for use by Flask templates. Replaces the old generate_landing.py approach
 of baking data into a monolithic HTML file.
+Set EFP_DEBUG_JSON=1 to also write an indented site_metrics.pretty.json.
 """
 
-import json
+import os
 from pathlib import Path
 from datetime import datetime
 
 import pandas as pd
 import numpy as np
+import orjson
 
-DATA_DIR = Path("C:/TradingData/greysky/data")
-OUTPUT_DIR = Path(__file__).parent / "data"
-
+from site_core import DATA_DIR, load_curves, period_last, compute_core_stats, compute_annual_returns
 
-def compute_drawdown(equity):
-    peak = equity.cummax()
-    return (equity - peak) / peak
+OUTPUT_DIR = Path(__file__).parent / "data"
 
 
-def compute_annual_returns(equity):
-    annual = equity.resample('YE').last().pct_change().dropna()
-    return {int(d.year): round(v * 100, 1) for d, v in annual.items()}
+def chart_values(values, decimals=1):
+    """Round a chart series once with numpy; float32 is ample for 1-decimal chart points."""
+    return np.round(values.to_numpy(), decimals).astype(np.float32)
 
 
-def compute_monthly_returns(equity):
-    monthly = equity.resample('ME').last().pct_change().dropna()
-    return {d.strftime('%Y-%m'): round(v * 100, 2) for d, v in monthly.items()}
+def compute_monthly_returns(monthly):
+    months = monthly.index.strftime('%Y-%m').tolist()
+    return dict(zip(months, np.round(monthly.to_numpy() * 100, 2).tolist()))
 
 
 def generate():
     print("Generating site_metrics.json...")
 
-    eq_path = DATA_DIR / 'all_equity_curves.csv'
-    curves = pd.read_csv(eq_path, index_col=0, parse_dates=True)
+    curves = load_curves()
 
     wf = curves['WalkForward'].dropna()
 
@@ -45,94 +42,65 @@ def generate():
     nifty = nifty50_raw.loc[wf.index[0]:wf.index[-1]].dropna()
 
     # --- Core metrics ---
-    wf_start, wf_end = wf.index[0], wf.index[-1]
-    years = (wf_end - wf_start).days / 365.25
-    total_ret = wf.iloc[-1] / wf.iloc[0] - 1
-    cagr = (1 + total_ret) ** (1 / years) - 1
-    dd = compute_drawdown(wf)
-    max_dd = dd.min()
-    rets = wf.pct_change().dropna()
-    sharpe = rets.mean() / rets.std() * np.sqrt(252) if rets.std() > 0 else 0
-    calmar = cagr / abs(max_dd) if max_dd != 0 else 0
-    multiple = wf.iloc[-1] / wf.iloc[0]
-
-    nifty_total = nifty.iloc[-1] / nifty.iloc[0] - 1
-    nifty_cagr = (1 + nifty_total) ** (1 / years) - 1
-    alpha = cagr - nifty_cagr
-
-    monthly_wf = wf.resample('ME').last().pct_change().dropna()
-    monthly_nifty = nifty.resample('ME').last().pct_change().dropna()
-    common_m = monthly_wf.index.intersection(monthly_nifty.index)
-    cov = np.cov(monthly_wf.loc[common_m].values, monthly_nifty.loc[common_m].values)
-    beta = cov[0, 1] / cov[1, 1] if cov[1, 1] > 0 else 0
-
-    win_rate = round((monthly_wf.loc[common_m] > 0).mean() * 100, 0)
+    stats = compute_core_stats(wf, nifty)
+    dd = stats['drawdown']
 
     hero = {
-        'cagr': round(cagr * 100, 1),
-        'max_dd': round(max_dd * 100, 1),
-        'sharpe': round(sharpe, 2),
-        'calmar': round(calmar, 2),
-        'alpha': round(alpha * 100, 1),
-        'beta': round(beta, 2),
-        'multiple': round(multiple, 1),
-        'win_rate': int(win_rate),
-        'period_start': wf_start.strftime('%b %Y'),
-        'period_end': wf_end.strftime('%b %Y'),
-        'years': round(years, 1),
+        'cagr': round(stats['cagr'] * 100, 1),
+        'max_dd': round(stats['max_dd'] * 100, 1),
+        'sharpe': round(stats['sharpe'], 2),
+        'calmar': round(stats['calmar'], 2),
+        'alpha': round(stats['alpha'] * 100, 1),
+        'beta': round(stats['beta'], 2),
+        'multiple': round(stats['multiple'], 1),
+        'win_rate': int(stats['win_rate']),
+        'period_start': stats['start'].strftime('%b %Y'),
+        'period_end': stats['end'].strftime('%b %Y'),
+        'years': round(stats['years'], 1),
         'trades': len(pd.read_csv(DATA_DIR / 'wf_trades.csv')) if (DATA_DIR / 'wf_trades.csv').exists() else 0,
         'windows': 21,
     }
 
+    # --- Period-end samples (one pass per frequency over all series) ---
+    frame = pd.DataFrame({'wf': wf, 'nifty': nifty, 'dd': dd})
+    weekly = period_last(frame, 'W')
+    yearly = period_last(frame[['wf', 'nifty']], 'Y')
+
     # --- Equity curve (weekly, normalized to 100) ---
-    norm_wf = wf / wf.iloc[0] * 100
-    norm_nifty = nifty / nifty.iloc[0] * 100
-    wf_weekly = norm_wf.resample('W').last().dropna()
-    nifty_weekly = norm_nifty.resample('W').last().dropna()
+    wf_weekly = (weekly['wf'] / wf.iloc[0] * 100).dropna()
+    nifty_weekly = (weekly['nifty'] / nifty.iloc[0] * 100).dropna()
 
     equity_curve = {
         'wf': {
-            'dates': [d.strftime('%Y-%m-%d') for d in wf_weekly.index],
-            'values': [round(v, 1) for v in wf_weekly.values],
+            'dates': wf_weekly.index.strftime('%Y-%m-%d').tolist(),
+            'values': chart_values(wf_weekly),
         },
         'nifty': {
-            'dates': [d.strftime('%Y-%m-%d') for d in nifty_weekly.index],
-            'values': [round(v, 1) for v in nifty_weekly.values],
+            'dates': nifty_weekly.index.strftime('%Y-%m-%d').tolist(),
+            'values': chart_values(nifty_weekly),
         },
     }
 
     # --- Annual returns ---
-    wf_annual = compute_annual_returns(wf)
-    nifty_annual = compute_annual_returns(nifty)
-    all_years = sorted(set(list(wf_annual.keys()) + list(nifty_annual.keys())))
-
-    annual_returns = {
-        'years': all_years,
-        'wf': {str(k): v for k, v in wf_annual.items()},
-        'nifty': {str(k): v for k, v in nifty_annual.items()},
-    }
+    annual_returns = compute_annual_returns(yearly)
 
     # --- Monthly returns (for heatmap on performance page) ---
-    monthly_returns = compute_monthly_returns(wf)
+    monthly_returns = compute_monthly_returns(stats['monthly_returns'])
 
     # --- Drawdown series (weekly) ---
-    dd_weekly = dd.resample('W').last().dropna()
+    dd_weekly = weekly['dd'].dropna()
     drawdown = {
-        'dates': [d.strftime('%Y-%m-%d') for d in dd_weekly.index],
-        'values': [round(v * 100, 1) for v in dd_weekly.values],
+        'dates': dd_weekly.index.strftime('%Y-%m-%d').tolist(),
+        'values': chart_values(dd_weekly * 100),
     }
 
     # --- Nifty metrics for comparison ---
-    nifty_dd = compute_drawdown(nifty)
-    nifty_rets_daily = nifty.pct_change().dropna()
-    nifty_sharpe = nifty_rets_daily.mean() / nifty_rets_daily.std() * np.sqrt(252) if nifty_rets_daily.std() > 0 else 0
-    nifty_max_dd = nifty_dd.min()
     nifty_multiple = nifty.iloc[-1] / nifty.iloc[0]
 
     benchmark = {
-        'cagr': round(nifty_cagr * 100, 1),
-        'sharpe': round(nifty_sharpe, 2),
-        'max_dd': round(nifty_max_dd * 100, 1),
+        'cagr': round(stats['nifty_cagr'] * 100, 1),
+        'sharpe': round(stats['nifty_sharpe'], 2),
+        'max_dd': round(stats['nifty_max_dd'] * 100, 1),
         'multiple': round(nifty_multiple, 1),
     }
 
@@ -141,11 +109,11 @@ def generate():
     if alloc_path.exists():
         alloc_df = pd.read_csv(alloc_path, parse_dates=['date'])
         allocation = {
-            'dates': [d.strftime('%Y-%m-%d') for d in alloc_df['date']],
-            'equity_pct': [round(v * 100, 1) for v in alloc_df['equity_pct']],
-            'gold_pct': [round(v * 100, 1) for v in alloc_df['gold_pct']],
-            'debt_pct': [round(v * 100, 1) for v in alloc_df['debt_pct']],
-            'confidence': [round(v, 3) for v in alloc_df['confidence']],
+            'dates': alloc_df['date'].dt.strftime('%Y-%m-%d').tolist(),
+            'equity_pct': np.round(alloc_df['equity_pct'].to_numpy() * 100, 1).tolist(),
+            'gold_pct': np.round(alloc_df['gold_pct'].to_numpy() * 100, 1).tolist(),
+            'debt_pct': np.round(alloc_df['debt_pct'].to_numpy() * 100, 1).tolist(),
+            'confidence': np.round(alloc_df['confidence'].to_numpy(), 3).tolist(),
         }
         print(f"Allocation: {len(alloc_df)} periods, equity range {min(allocation['equity_pct'])}-{max(allocation['equity_pct'])}%")
     else:
@@ -189,7 +157,13 @@ def generate():
 
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     output_path = OUTPUT_DIR / 'site_metrics.json'
-    output_path.write_text(json.dumps(site_data, indent=2), encoding='utf-8')
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    output_path.write_bytes(orjson.dumps(site_data, option=options))
+    if os.environ.get('EFP_DEBUG_JSON') == '1':
+        # Human-readable copy for debugging; the site only reads the minified file
+        pretty_path = OUTPUT_DIR / 'site_metrics.pretty.json'
+        pretty_path.write_bytes(orjson.dumps(site_data, option=options | orjson.OPT_INDENT_2))
+        print(f"Written {pretty_path}")
     size_kb = output_path.stat().st_size / 1024
     print(f"Written {output_path} ({size_kb:.0f} KB)")
     print(f"Hero: CAGR={hero['cagr']}%, Sharpe={hero['sharpe']}, MDD={hero['max_dd']}%, Alpha={hero['alpha']}%")
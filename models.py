@@ -2,52 +2,154 @@
 
 import secrets
 import string
-from datetime import datetime, timezone
 
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
 
 db = SQLAlchemy()
 
+# Native ENUM types on MySQL/PostgreSQL; a short VARCHAR elsewhere
+KYC_STATUS = db.Enum('pending', 'submitted', 'verified', name='kyc_status_enum')
+RISK_PROFILE = db.Enum('conservative', 'moderate', 'aggressive', name='risk_profile_enum')
+REFERRAL_STATUS = db.Enum('invited', 'registered', 'approved', name='referral_status_enum')
+
+
+_REFERRAL_ALPHABET = string.ascii_uppercase + string.digits
+_ALPHABET_LEN = len(_REFERRAL_ALPHABET)
+_BYTE_LIMIT = 256 - 256 % _ALPHABET_LEN   # reject bytes >= 252 so every symbol is equally likely
+
 
 def generate_referral_code(length=6):
     """Generate a unique referral code like 'EFP-A3K7M2'."""
-    chars = string.ascii_uppercase + string.digits
-    return 'EFP-' + ''.join(secrets.choice(chars) for _ in range(length))
+    chars = []
+    while len(chars) < length:
+        # One urandom read per batch; a refill is needed only if a byte was rejected
+        chars.extend(_REFERRAL_ALPHABET[b % _ALPHABET_LEN]
+                     for b in secrets.token_bytes(length) if b < _BYTE_LIMIT)
+    return 'EFP-' + ''.join(chars[:length])
+
+
+def _is_referral_code_collision(error):
+    """True if an IntegrityError came from the users.referral_code unique constraint."""
+    # SQLite/MySQL name the column in the message, PostgreSQL the constraint (users_referral_code_key)
+    return 'referral_code' in str(error.orig)
+
+
+def add_with_referral_code(user, attempts=3):
+    """Add a new user to the session with a fresh referral code.
+
+    Relies on the unique constraint instead of probing for existing codes:
+    each attempt flushes inside a savepoint and a code collision simply retries.
+    Any other integrity error (e.g. a duplicate email) is raised immediately.
+    """
+    if attempts < 1:
+        raise ValueError('attempts must be at least 1')
+    for attempt in range(1, attempts + 1):
+        user.referral_code = generate_referral_code()
+        try:
+            with db.session.begin_nested():
+                db.session.add(user)
+            return user
+        except IntegrityError as e:
+            if attempt == attempts or not _is_referral_code_collision(e):
+                raise
 
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
 
     id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(255), unique=True, nullable=False)
-    password_hash = db.Column(db.String(255), nullable=False)
+    email = db.Column(db.String(254), unique=True, nullable=False)        # RFC 5321 max
+    password_hash = db.Column(db.CHAR(60), nullable=False)                # bcrypt hashes are 60 chars
     name = db.Column(db.String(255), nullable=False)
     approved = db.Column(db.Boolean, default=False)
     is_admin = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime(timezone=True), default=db.func.now(), server_default=db.func.now(),
+                           nullable=False)
 
     # Profile & KYC
     phone = db.Column(db.String(20), nullable=True)
-    pan_number = db.Column(db.String(10), nullable=True)
-    kyc_status = db.Column(db.String(20), default='pending')       # pending | submitted | verified
-    risk_profile = db.Column(db.String(20), default='moderate')    # conservative | moderate | aggressive
+    pan_number = db.Column(db.CHAR(10), nullable=True)
+    kyc_status = db.Column(KYC_STATUS, default='pending')
+    risk_profile = db.Column(RISK_PROFILE, default='moderate')
 
     # Referral
-    referral_code = db.Column(db.String(12), unique=True, nullable=True)
-    referred_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    referral_code = db.Column(db.CHAR(10), unique=True, nullable=True)   # 'EFP-' + 6 chars
+    referred_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
 
     # Terms acceptance
     terms_accepted_at = db.Column(db.DateTime, nullable=True)      # NULL = not accepted
-    terms_version = db.Column(db.String(10), nullable=True)        # e.g. "1.0"
+    terms_version_id = db.Column(db.SmallInteger, db.ForeignKey('terms_versions.id'), nullable=True)
+
+    # Latest capital snapshot, denormalized from CapitalRecord so the dashboard needs no scan
+    latest_invested = db.Column(db.Numeric(18, 4), nullable=True)
+    latest_value = db.Column(db.Numeric(18, 4), nullable=True)
+    latest_snapshot_date = db.Column(db.Date, nullable=True)
 
     # Relationships
-    capital_records = db.relationship('CapitalRecord', backref='user', lazy='dynamic')
+    terms = db.relationship('TermsVersion')
+    capital_records = db.relationship('CapitalRecord', backref='user')
     referrals_made = db.relationship('User', backref=db.backref('referrer', remote_side=[id]))
-    sent_referrals = db.relationship('Referral', backref='referrer_user', lazy='dynamic')
+    sent_referrals = db.relationship('Referral', backref='referrer_user')
+
+    __table_args__ = (
+        # Partial index for the admin approval queue: only unapproved rows are indexed
+        db.Index('ix_user_pending', 'created_at',
+                 postgresql_where=db.text('approved = false'),
+                 sqlite_where=db.text('approved = 0')),
+    )
+
+    @property
+    def terms_version(self):
+        """Accepted T&C version string, e.g. "1.0" (None if not accepted)."""
+        return self.terms.version if self.terms else None
+
+    def apply_capital_record(self, record):
+        """Refresh the latest_* snapshot fields if record is the newest one."""
+        if self.latest_snapshot_date is None or record.date >= self.latest_snapshot_date:
+            self.latest_invested = record.invested
+            self.latest_value = record.current_value
+            self.latest_snapshot_date = record.date
+
+    def __repr__(self):
+        # Reads only already-loaded state so repr never triggers a refresh SELECT
+        loaded = inspect(self).dict
+        return f"<User {loaded.get('email', '?')}>"
+
+
+class TermsVersion(db.Model):
+    """Published Terms & Conditions versions; users reference the one they accepted."""
+    __tablename__ = 'terms_versions'
+
+    id = db.Column(db.SmallInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    version = db.Column(db.String(10), unique=True, nullable=False)   # e.g. "1.0"
+    published_at = db.Column(db.DateTime(timezone=True), default=db.func.now(), server_default=db.func.now(),
+                             nullable=False)
+
+    @classmethod
+    def get_or_create(cls, version):
+        """Return the row for version, inserting it if it has not been published yet.
+
+        Versions are normally published up front with 'flask publish-terms'; the
+        insert here is a fallback, done in a savepoint so a concurrent insert of the
+        same version is picked up instead of failing on the unique constraint.
+        """
+        terms = cls.query.filter_by(version=version).first()
+        if terms is not None:
+            return terms
+        terms = cls(version=version)
+        try:
+            with db.session.begin_nested():
+                db.session.add(terms)
+        except IntegrityError:
+            terms = cls.query.filter_by(version=version).one()
+        return terms
 
     def __repr__(self):
-        return f'<User {self.email}>'
+        loaded = inspect(self).dict
+        return f"<TermsVersion {loaded.get('version', '?')}>"
 
 
 class CapitalRecord(db.Model):
@@ -57,17 +159,20 @@ class CapitalRecord(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     date = db.Column(db.Date, nullable=False)
-    invested = db.Column(db.Float, nullable=False)         # total capital deployed (cumulative)
-    current_value = db.Column(db.Float, nullable=False)    # current portfolio value
+    invested = db.Column(db.Numeric(18, 4), nullable=False)       # total capital deployed (cumulative)
+    current_value = db.Column(db.Numeric(18, 4), nullable=False)  # current portfolio value
     note = db.Column(db.String(255), nullable=True)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime(timezone=True), default=db.func.now(), server_default=db.func.now(),
+                           nullable=False)
 
     __table_args__ = (
         db.UniqueConstraint('user_id', 'date', name='uq_user_date'),
     )
 
     def __repr__(self):
-        return f'<Capital {self.user_id} {self.date}: {self.invested}→{self.current_value}>'
+        loaded = inspect(self).dict
+        return (f"<Capital {loaded.get('user_id', '?')} {loaded.get('date', '?')}: "
+                f"{loaded.get('invested', '?')}→{loaded.get('current_value', '?')}>")
 
 
 class Referral(db.Model):
@@ -76,9 +181,24 @@ class Referral(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     referrer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    referred_email = db.Column(db.String(255), nullable=False)
-    status = db.Column(db.String(20), default='invited')   # invited | registered | approved
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    referred_email = db.Column(db.String(254), nullable=False)
+    status = db.Column(REFERRAL_STATUS, default='invited')
+    created_at = db.Column(db.DateTime(timezone=True), default=db.func.now(), server_default=db.func.now(),
+                           nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_ref_referrer_status', 'referrer_id', 'status'),
+    )
+
+    @classmethod
+    def bulk_create(cls, referrer_id, emails, status='invited'):
+        """Insert one referral per email with a single executemany INSERT (caller commits)."""
+        if emails:
+            db.session.execute(cls.__table__.insert(), [
+                {'referrer_id': referrer_id, 'referred_email': email, 'status': status}
+                for email in emails
+            ])
 
     def __repr__(self):
-        return f'<Referral {self.referred_email} [{self.status}]>'
+        loaded = inspect(self).dict
+        return f"<Referral {loaded.get('referred_email', '?')} [{loaded.get('status', '?')}]>"
@@ -0,0 +1,152 @@
+"""
+EFP Wealth — Site Core
+Equity-curve loading and headline metrics for generate_site_data.py.
+The per-curve statistics run in a single numba-compiled pass when numba is
+installed, and as plain Python otherwise.
+"""
+
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda f: f
+
+DATA_DIR = Path("C:/TradingData/greysky/data")
+
+
+def compute_drawdown(equity):
+    arr = equity.to_numpy()
+    peak = np.maximum.accumulate(arr)
+    return pd.Series((arr - peak) / peak, index=equity.index)
+
+
+def _simple_returns(arr):
+    return arr[1:] / arr[:-1] - 1
+
+
+@njit(cache=True)
+def _curve_kernel(values, month_ids):
+    """Single pass over a daily curve.
+
+    Tracks the running peak for max drawdown, Welford mean/M2 of daily
+    returns, and the row position of each month's last observation.
+    """
+    n = len(values)
+    peak = values[0]
+    max_dd = 0.0
+    mean = 0.0
+    m2 = 0.0
+    month_ends = np.empty(n, dtype=np.int64)
+    n_months = 0
+    for i in range(n):
+        v = values[i]
+        if v > peak:
+            peak = v
+        dd = (v - peak) / peak
+        if dd < max_dd:
+            max_dd = dd
+        if i > 0:
+            r = v / values[i - 1] - 1.0
+            delta = r - mean
+            mean += delta / i
+            m2 += delta * (r - mean)
+        if i == n - 1 or month_ids[i + 1] != month_ids[i]:
+            month_ends[n_months] = i
+            n_months += 1
+    return max_dd, mean, m2, month_ends[:n_months]
+
+
+def _curve_stats(equity):
+    """Max drawdown, annualised Sharpe and month-end closes of a daily curve."""
+    values = equity.to_numpy(dtype=np.float64)
+    month_ids = (equity.index.year * 12 + equity.index.month).to_numpy(dtype=np.int64)
+    max_dd, mean, m2, month_ends = _curve_kernel(values, month_ids)
+    n_rets = len(values) - 1
+    std = np.sqrt(m2 / (n_rets - 1)) if n_rets > 1 else 0
+    sharpe = mean / std * np.sqrt(252) if std > 0 else 0
+    return max_dd, sharpe, month_ids[month_ends], month_ends
+
+
+def period_last(frame, freq):
+    """Last value of each column per calendar period ('W', 'M' or 'Y').
+
+    One groupby serves every column of the frame. Rows are labelled with the
+    period end date, matching resample('W'/'ME'/'YE').last().
+    """
+    last = frame.groupby(frame.index.to_period(freq)).last()
+    last.index = last.index.to_timestamp(how='end').normalize()
+    return last
+
+
+def compute_annual_returns(yearly):
+    """Calendar-year returns (%) for every column of a year-end frame built by period_last.
+
+    Returns {'years': [...], <column>: {'YYYY': pct, ...}, ...}; one pct_change
+    covers all columns.
+    """
+    annual = yearly.pct_change().dropna(how='all')
+    result = {'years': annual.index.year.tolist()}
+    for col in annual.columns:
+        col_annual = annual[col].dropna()
+        years = col_annual.index.year.astype(str).tolist()
+        result[col] = dict(zip(years, np.round(col_annual.to_numpy() * 100, 1).tolist()))
+    return result
+
+
+def load_curves():
+    """Load the WalkForward column of all_equity_curves.csv (the benchmark comes from etfs/NIFTY50.parquet)."""
+    curves = pd.read_csv(DATA_DIR / 'all_equity_curves.csv', index_col=0,
+                         usecols=['Date', 'WalkForward'], engine='pyarrow')
+    curves.index = pd.to_datetime(curves.index)
+    return curves
+
+
+def compute_core_stats(wf, nifty):
+    """Headline metrics for the walk-forward curve against a benchmark curve."""
+    wf_start, wf_end = wf.index[0], wf.index[-1]
+    years = (wf_end - wf_start).days / 365.25
+    total_ret = wf.iloc[-1] / wf.iloc[0] - 1
+    cagr = (1 + total_ret) ** (1 / years) - 1
+    max_dd, sharpe, wf_months, wf_ends = _curve_stats(wf)
+    calmar = cagr / abs(max_dd) if max_dd != 0 else 0
+    multiple = wf.iloc[-1] / wf.iloc[0]
+
+    nifty_total = nifty.iloc[-1] / nifty.iloc[0] - 1
+    nifty_cagr = (1 + nifty_total) ** (1 / years) - 1
+    alpha = cagr - nifty_cagr
+    nifty_max_dd, nifty_sharpe, nifty_months, nifty_ends = _curve_stats(nifty)
+
+    # Monthly returns from month-end closes, aligned on months both curves have
+    monthly_wf = _simple_returns(wf.to_numpy()[wf_ends])
+    monthly_nifty = _simple_returns(nifty.to_numpy()[nifty_ends])
+    _, iw, ini = np.intersect1d(wf_months[1:], nifty_months[1:], assume_unique=True, return_indices=True)
+    x, y = monthly_wf[iw], monthly_nifty[ini]
+    mx, my = x.mean(), y.mean()
+    var_y = y @ y / len(y) - my * my
+    beta = (x @ y / len(x) - mx * my) / var_y if var_y > 0 else 0
+
+    win_rate = round((x > 0).mean() * 100, 0)
+
+    return {
+        'start': wf_start,
+        'end': wf_end,
+        'years': years,
+        'cagr': cagr,
+        'max_dd': max_dd,
+        'sharpe': sharpe,
+        'calmar': calmar,
+        'multiple': multiple,
+        'alpha': alpha,
+        'beta': beta,
+        'win_rate': win_rate,
+        'nifty_cagr': nifty_cagr,
+        'nifty_max_dd': nifty_max_dd,
+        'nifty_sharpe': nifty_sharpe,
+        'drawdown': compute_drawdown(wf),
+        'monthly_returns': pd.Series(monthly_wf, index=wf.index[wf_ends[1:]]),
+    }
@@ -10,8 +10,11 @@ path = '/home/YOURUSERNAME/efpwealth'
 if path not in sys.path:
     sys.path.insert(0, path)
 
-# Set a strong secret key (change this to a random string)
-if 'SECRET_KEY' not in os.environ:
-    os.environ['SECRET_KEY'] = 'CHANGE-ME-TO-A-RANDOM-SECRET'
+# Set SECRET_KEY to a long random string in the PythonAnywhere web app's
+# environment (or in this file's WSGI config); there is no fallback here.
+SECRET_KEY = os.environ.get('SECRET_KEY')
+if not SECRET_KEY:
+    raise RuntimeError('SECRET_KEY is not set; refusing to start with a default key.')
 
-from app import app as application
+from app import create_app
+application = create_app(secret_key=SECRET_KEY)